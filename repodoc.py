@@ -1,24 +1,55 @@
+import os
 import re
+import secrets
 import shutil
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
+from typing import BinaryIO
 
 import requests
+from requests.adapters import HTTPAdapter
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Confirm, Prompt
+from rich.status import Status
 
 # ---------------------------------------------------------------------------
 # Constants
 # ---------------------------------------------------------------------------
 
-UNSAFE_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+# str.translate table deleting characters that are unsafe in filenames
+UNSAFE_FILENAME_CHARS = str.maketrans("", "", '<>:"/\\|?*' + "".join(chr(i) for i in range(0x20)))
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+GITHUB_URL = re.compile(r"https?://github\.com/([\w-]+)/([\w.-]+)")
+
+MARKDOWN_SUFFIXES = (".md", ".MD", ".Md", ".mD")
+EXCLUDED_DIRS = re.compile(r"(?:^|/)(?:[^/]*venv|node_modules|vendor|\.git|\.tox|dist|build)/")
 
 MAX_DOWNLOAD_SIZE = 100 * 1024 * 1024  # 100 MB
+MAX_ENTRY_SIZE = 10 * 1024 * 1024  # 10 MB per extracted Markdown file
 REQUEST_TIMEOUT = 30  # seconds
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 64 KB
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # archives larger than this spill to disk
+SMALL_ARCHIVE_SIZE = 2 * 1024 * 1024  # archives smaller than this skip streaming
+# zipfile needs seekable(), which SpooledTemporaryFile only gained in Python 3.11;
+# older versions stream straight into an unspooled temp file
+SPOOLED_FILE_SEEKABLE = hasattr(tempfile.SpooledTemporaryFile, "seekable")
+COPY_BUFFER_SIZE = 1024 * 1024  # 1 MB per read when decompressing entries
+EXTRACT_WORKERS = min(8, os.cpu_count() or 4)
+
+# Zip local file header layout (mirrors zipfile.structFileHeader)
+LOCAL_FILE_HEADER = struct.Struct("<4s2B4HL2L2H")
+LOCAL_FILE_HEADER_SIGNATURE = b"PK\x03\x04"
+# File-to-file sendfile is only supported on Linux (same check as shutil)
+USE_SENDFILE = hasattr(os, "sendfile") and sys.platform.startswith("linux")
 
 REPODOC_BANNER = (
     "[bold bright_green]██████╗ ███████╗██████╗  ██████╗ ██████╗  ██████╗  ██████╗ [/]\n"
@@ -29,8 +60,25 @@ REPODOC_BANNER = (
     "[dark_green]╚═╝  ╚═╝╚══════╝╚═╝      ╚═════╝ ╚═════╝  ╚═════╝  ╚═════╝[/]"
 )
 
+WELCOME_PANEL = Panel(
+    "[bold bright_green]Repository Documentation Downloader[/bold bright_green]\n\n"
+    "Downloads all .md files from a GitHub repository and organizes them.",
+    title="[bold green]repodoc[/bold green]",
+    border_style="green",
+    padding=(1, 2),
+)
+
+COMPILE_COMPLETE_PANEL = Panel(
+    "[green]Successfully compiled PDF![/green]",
+    title="Compile Complete",
+    border_style="green",
+)
+
 # Path to the md2pdf executable
-MD2PDF_PATH = Path.home() / "md2pdf" / "md2pdf"
+MD2PDF_PATH = (Path.home() / "md2pdf" / "md2pdf").resolve()
+MD2PDF_DIR = MD2PDF_PATH.parent
+MD2PDF_CMD_STR = str(MD2PDF_PATH)
+MD2PDF_OUTPUT_TAIL_LINES = 200  # lines of md2pdf output kept for error reports
 
 # --------------------------------------------------------------------------- 
 # Rich console
@@ -38,17 +86,35 @@ MD2PDF_PATH = Path.home() / "md2pdf" / "md2pdf"
 
 console = Console()
 
+# --------------------------------------------------------------------------- 
+# HTTP session
+# --------------------------------------------------------------------------- 
+
+# Shared keep-alive session; archives are already deflate-compressed, so ask
+# the server not to compress the transfer a second time
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+SESSION.headers["Accept-Encoding"] = "identity"
+
 # --------------------------------------------------------------------------- 
 # Helper Functions
 # --------------------------------------------------------------------------- 
 
 def sanitize_filename(name: str) -> str:
     """Remove unsafe characters from a filename."""
-    clean = UNSAFE_FILENAME_CHARS.sub("", name).strip(". ")
+    clean = name.translate(UNSAFE_FILENAME_CHARS).strip(". ")
     if not clean:
         clean = "output"
     return clean[:200]
 
+def remove_stale_dir(path: Path, errors: list[OSError]) -> None:
+    """Delete a previous output directory, collecting failures for the caller to report."""
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(path, onexc=lambda func, failed_path, exc: errors.append(exc))
+    else:
+        # onerror is deprecated from 3.12 in favour of onexc
+        shutil.rmtree(path, onerror=lambda func, failed_path, exc_info: errors.append(exc_info[1]))
+
 def get_repo_url() -> str:
     """Prompt user for a GitHub repository URL."""
     console.print()
@@ -59,7 +125,7 @@ def get_repo_url() -> str:
 
 def validate_url(url: str) -> tuple[str, str] | None:
     """Validate GitHub URL and extract owner/repo."""
-    match = re.match(r"https?://github\.com/([\w-]+)/([\w.-]+)", url)
+    match = GITHUB_URL.match(url)
     if not match:
         return None
     return match.groups()
@@ -68,68 +134,210 @@ def validate_url(url: str) -> tuple[str, str] | None:
 # Core Logic
 # ---------------------------------------------------------------------------
 
-def download_and_extract(owner: str, repo: str, dest: Path) -> list[Path]:
-    """Download repo zip, extract .md files, and save them with original names."""
+def probe_archive(owner: str, repo: str, status: Status) -> requests.Response | None:
+    """HEAD the zip archive for the repo's main or master branch, probing both at once."""
     zip_url = f"https://github.com/{owner}/{repo}/archive/refs/heads/main.zip"
     alt_zip_url = f"https://github.com/{owner}/{repo}/archive/refs/heads/master.zip"
+
+    # Probe both branches concurrently so master-only repos don't wait on main's 404.
+    # The pool isn't waited on: main repos return as soon as their own probe
+    # succeeds, and the master probe is only collected on the 404 path
+    pool = ThreadPoolExecutor(max_workers=2)
+    main_probe = pool.submit(SESSION.head, zip_url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    master_probe = pool.submit(SESSION.head, alt_zip_url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    pool.shutdown(wait=False)
+
+    try:
+        main_response = main_probe.result()
+        main_response.raise_for_status()
+        return main_response
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code != 404:
+            console.print(f"[red]Error:[/red] Failed to download repository: {e}")
+            return None
+    except requests.exceptions.RequestException as e:
+        console.print(f"[red]Error:[/red] Failed to download repository: {e}")
+        return None
+
+    status.update("Main branch not found, trying master...")
+    try:
+        master_response = master_probe.result()
+        master_response.raise_for_status()
+        return master_response
+    except requests.exceptions.RequestException as e_alt:
+        console.print(f"[red]Error:[/red] Failed to download from both main and master branches: {e_alt}")
+        return None
+
+def stream_to_tempfile(response: requests.Response) -> BinaryIO | None:
+    """Stream a response body into a spooled temp file, enforcing the download size limit."""
+    if SPOOLED_FILE_SEEKABLE:
+        archive = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    else:
+        archive = tempfile.TemporaryFile()
+    total = 0
+    with response:
+        try:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if total > MAX_DOWNLOAD_SIZE:
+                    console.print(f"[red]Error:[/red] Repository archive exceeds {MAX_DOWNLOAD_SIZE // (1024 * 1024)} MB limit.")
+                    archive.close()
+                    return None
+                archive.write(chunk)
+        except requests.exceptions.RequestException as e:
+            console.print(f"[red]Error:[/red] Failed to download repository: {e}")
+            archive.close()
+            return None
+
+    archive.seek(0)
+    return archive
+
+def open_output(dir_fd: int, name: str) -> BinaryIO:
+    """Open name for writing relative to an already-open directory descriptor."""
+    fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=dir_fd)
+    return os.fdopen(fd, "wb")
+
+def copy_stored_entry(archive_fd: int, member: zipfile.ZipInfo, dir_fd: int, name: str) -> None:
+    """Copy an uncompressed archive member to name with sendfile, bypassing zipfile."""
+    header = os.pread(archive_fd, LOCAL_FILE_HEADER.size, member.header_offset)
+    fields = LOCAL_FILE_HEADER.unpack(header)
+    if fields[0] != LOCAL_FILE_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad magic number for file header: {member.filename}")
+
+    # The local header's extra field may differ from the central directory's
+    filename_length, extra_length = fields[-2], fields[-1]
+    offset = member.header_offset + LOCAL_FILE_HEADER.size + filename_length + extra_length
+    remaining = member.file_size
+    with open_output(dir_fd, name) as target:
+        while remaining:
+            sent = os.sendfile(target.fileno(), archive_fd, offset, remaining)
+            if sent == 0:
+                raise zipfile.BadZipFile(f"Truncated archive entry: {member.filename}")
+            offset += sent
+            remaining -= sent
+
+def extract_entry(z: zipfile.ZipFile, member: zipfile.ZipInfo, dir_fd: int, name: str, archive_fd: int | None = None) -> None:
+    """Decompress a single archive member to name inside the directory dir_fd."""
+    if (
+        archive_fd is not None
+        and member.compress_type == zipfile.ZIP_STORED
+        and not member.flag_bits & 0x1  # encrypted
+    ):
+        copy_stored_entry(archive_fd, member, dir_fd, name)
+        return
+
+    with z.open(member) as source, open_output(dir_fd, name) as target:
+        shutil.copyfileobj(source, target, length=COPY_BUFFER_SIZE)
+
+def download_and_extract(owner: str, repo: str, dest: Path) -> list[Path]:
+    """Download repo zip, extract .md files, and save them with original names."""
     saved_files = []
 
     with console.status("Downloading repository...") as status:
+        probe = probe_archive(owner, repo, status)
+        if probe is None:
+            return []
+
+        # GitHub usually reports the archive size up front, so oversized
+        # repositories can be rejected before any of the body is transferred
         try:
-            response = requests.get(zip_url, timeout=REQUEST_TIMEOUT)
+            archive_size = int(probe.headers.get("Content-Length", 0))
+        except ValueError:
+            # Malformed header: treat the size as unknown and rely on the streaming limit
+            archive_size = 0
+        if archive_size > MAX_DOWNLOAD_SIZE:
+            console.print(f"[red]Error:[/red] Repository archive exceeds {MAX_DOWNLOAD_SIZE // (1024 * 1024)} MB limit.")
+            return []
+
+        # Small archives are fetched in one go and kept in memory, where the
+        # overhead of streaming into a spooled file would dominate
+        small_archive = 0 < archive_size < SMALL_ARCHIVE_SIZE
+
+        try:
+            # probe.url is the post-redirect download URL
+            response = SESSION.get(probe.url, stream=not small_archive, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                status.update("Main branch not found, trying master...")
-                try:
-                    response = requests.get(alt_zip_url, timeout=REQUEST_TIMEOUT)
-                    response.raise_for_status()
-                except requests.exceptions.RequestException as e_alt:
-                    console.print(f"[red]Error:[/red] Failed to download from both main and master branches: {e_alt}")
-                    return []
-            else:
-                console.print(f"[red]Error:[/red] Failed to download repository: {e}")
-                return []
         except requests.exceptions.RequestException as e:
             console.print(f"[red]Error:[/red] Failed to download repository: {e}")
             return []
 
-        if len(response.content) > MAX_DOWNLOAD_SIZE:
-            console.print(f"[red]Error:[/red] Repository archive exceeds {MAX_DOWNLOAD_SIZE // (1024 * 1024)} MB limit.")
-            return []
+        if small_archive:
+            # The GET is a separate request from the HEAD, so bound the body actually received
+            if len(response.content) > MAX_DOWNLOAD_SIZE:
+                console.print(f"[red]Error:[/red] Repository archive exceeds {MAX_DOWNLOAD_SIZE // (1024 * 1024)} MB limit.")
+                return []
+            archive = BytesIO(response.content)
+        else:
+            archive = stream_to_tempfile(response)
+            if archive is None:
+                return []
 
         status.update("Extracting Markdown files...")
         try:
-            with zipfile.ZipFile(BytesIO(response.content)) as z:
-                # Find all markdown files
-                md_files = [
-                    name for name in z.namelist()
-                    if name.lower().endswith(".md") and "venv/" not in name and "node_modules/" not in name
-                ]
-
-                if not md_files:
+            with archive, zipfile.ZipFile(archive) as z:
+                # A spooled archive only has a real descriptor once it has rolled over
+                # to disk (plain temp files always have one); in-memory archives,
+                # including BytesIO, take the regular zipfile path
+                archive_fd = (
+                    archive.fileno()
+                    if USE_SENDFILE and archive.seekable() and getattr(archive, "name", None) is not None
+                    else None
+                )
+
+                # Output files are opened relative to the destination directory's
+                # descriptor, skipping a full path lookup for every entry
+                dest.mkdir(parents=True, exist_ok=True)
+                dir_fd = os.open(dest, os.O_RDONLY | os.O_DIRECTORY)
+                seen_names: set[str] = set()  # lowercase output names already claimed
+                saved_names: list[str] = []
+                try:
+                    # ZipFile serializes raw reads on its shared file handle, while zlib
+                    # releases the GIL, so entries can be inflated and written concurrently
+                    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as pool:
+                        futures = []
+                        # Filter, name and extract each entry in a single pass over the archive
+                        for info in z.infolist():
+                            if (
+                                info.is_dir()
+                                or not info.filename.endswith(MARKDOWN_SUFFIXES)
+                                or EXCLUDED_DIRS.search(info.filename)
+                            ):
+                                continue
+                            if info.file_size > MAX_ENTRY_SIZE:
+                                console.print(f"[yellow]Skipping {info.filename}: exceeds {MAX_ENTRY_SIZE // (1024 * 1024)} MB per-file limit.[/yellow]")
+                                continue
+
+                            # Split the zip path directly rather than building a Path per entry
+                            parts = info.filename.rsplit("/", 2)
+                            name = parts[-1]
+                            name_lower = name.lower()
+
+                            if name_lower in seen_names:
+                                # Collision: prepend parent directory to disambiguate
+                                parent = parts[-2] if len(parts) >= 2 else ""
+                                name = f"{parent}-{name}"
+                                # Entries are written concurrently, so every job needs a
+                                # distinct target; number any names that still collide
+                                stem, dot, suffix = name.rpartition(".")
+                                counter = 2
+                                while name.lower() in seen_names:
+                                    name = f"{stem}-{counter}{dot}{suffix}"
+                                    counter += 1
+                            seen_names.add(name.lower())
+
+                            futures.append(pool.submit(extract_entry, z, info, dir_fd, name, archive_fd))
+                            saved_names.append(name)
+
+                        for future in futures:
+                            future.result()
+                finally:
+                    os.close(dir_fd)
+
+                if not saved_names:
                     console.print("[yellow]No Markdown files found in the repository.[/yellow]")
                     return []
 
-                # Extract and save with original names, disambiguating collisions
-                dest.mkdir(parents=True, exist_ok=True)
-                seen_names: dict[str, str] = {}  # lowercase name -> first zip path
-                for full_path in md_files:
-                    p = Path(full_path)
-                    name = p.name
-                    name_lower = name.lower()
-
-                    if name_lower in seen_names:
-                        # Collision: prepend parent directory to disambiguate
-                        parent = p.parent.name
-                        name = f"{parent}-{name}"
-                    else:
-                        seen_names[name_lower] = full_path
-
-                    output_path = dest / name
-                    with z.open(full_path) as source, open(output_path, "wb") as target:
-                        shutil.copyfileobj(source, target)
-                    saved_files.append(output_path)
+                saved_files = [dest / name for name in saved_names]
 
         except zipfile.BadZipFile:
             console.print("[red]Error:[/red] Downloaded file is not a valid zip archive.")
@@ -142,8 +350,8 @@ def download_and_extract(owner: str, repo: str, dest: Path) -> list[Path]:
 
 def run_md2pdf(directory: Path):
     """Run the md2pdf compile command on the specified directory."""
-    if not MD2PDF_PATH.exists():
-        console.print(f"[red]Error:[/red] md2pdf executable not found at {MD2PDF_PATH}")
+    if not os.access(MD2PDF_CMD_STR, os.X_OK):
+        console.print(f"[red]Error:[/red] md2pdf executable not found or not executable at {MD2PDF_PATH}")
         console.print("Please ensure the md2pdf project is in your home directory.")
         return
 
@@ -151,34 +359,38 @@ def run_md2pdf(directory: Path):
     with console.status("Compiling PDF..."):
         try:
             # We need to provide the absolute path to the directory
-            command = [str(MD2PDF_PATH), "compile", str(directory.resolve())]
+            if not directory.is_absolute():
+                directory = directory.resolve()
+            command = [MD2PDF_CMD_STR, "compile", str(directory)]
             # The md2pdf script needs to be run from its own directory to find its modules
-            result = subprocess.run(
+            process = subprocess.Popen(
                 command,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True,
-                cwd=MD2PDF_PATH.parent
+                bufsize=1,
+                cwd=MD2PDF_DIR
             )
 
-            if result.returncode == 0:
-                # Strip ANSI escape codes before searching for the output path
-                ansi_escape = re.compile(r'\x1b\[[0-9;]*m')
-                clean_stdout = ansi_escape.sub('', result.stdout)
-                output_line = next(
-                    (line for line in clean_stdout.splitlines() if "Saved:" in line),
-                    None,
-                )
-                if output_line:
-                    console.print(output_line.strip())
-                console.print(Panel(
-                    "[green]Successfully compiled PDF![/green]",
-                    title="Compile Complete",
-                    border_style="green",
-                ))
+            # Stream output line by line so the saved path shows up as soon as md2pdf
+            # reports it; only the tail is kept around for error reporting
+            output_tail: deque[str] = deque(maxlen=MD2PDF_OUTPUT_TAIL_LINES)
+            output_line = None
+            with process:
+                for line in process.stdout:
+                    output_tail.append(line)
+                    if output_line is None:
+                        # Strip ANSI escape codes before searching for the output path
+                        clean_line = ANSI_ESCAPE.sub('', line)
+                        if "Saved:" in clean_line:
+                            output_line = clean_line.strip()
+                            console.print(output_line)
+
+            if process.returncode == 0:
+                console.print(COMPILE_COMPLETE_PANEL)
             else:
                 console.print("[red]Error during PDF compilation:[/red]")
-                console.print(result.stdout)
-                console.print(result.stderr)
+                console.print("".join(output_tail))
 
         except Exception as e:
             console.print(f"[red]An unexpected error occurred while running md2pdf:[/red] {e}")
@@ -195,13 +407,7 @@ def main():
     console.print(REPODOC_BANNER)
     console.print()
     console.print("[dark_green]━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━[/]")
-    console.print(Panel(
-        "[bold bright_green]Repository Documentation Downloader[/bold bright_green]\n\n"
-        "Downloads all .md files from a GitHub repository and organizes them.",
-        title="[bold green]repodoc[/bold green]",
-        border_style="green",
-        padding=(1, 2),
-    ))
+    console.print(WELCOME_PANEL)
 
     url = get_repo_url()
     repo_info = validate_url(url)
@@ -214,14 +420,34 @@ def main():
     safe_repo_name = sanitize_filename(repo)
     output_dir = Path.cwd() / safe_repo_name
 
+    cleanup = None
     if output_dir.exists():
         if not Confirm.ask(f"[yellow]Directory '{output_dir.name}' already exists. Overwrite?[/yellow]", default=False):
             console.print("[dim]Aborted.[/dim]")
             return
-        shutil.rmtree(output_dir)
+        if output_dir.is_symlink() or not output_dir.is_dir():
+            console.print(f"[red]Error:[/red] '{output_dir.name}' is not a directory; remove it manually.")
+            return
+
+        # Move the previous output aside and delete it in the background,
+        # overlapping the cleanup with the download
+        stale_dir = output_dir.with_name(f"{output_dir.name}.old-{secrets.token_hex(4)}")
+        try:
+            os.rename(output_dir, stale_dir)
+        except OSError as e:
+            console.print(f"[red]Error:[/red] Failed to move existing directory aside: {e}")
+            return
+        cleanup_errors: list[OSError] = []
+        cleanup = threading.Thread(target=remove_stale_dir, args=(stale_dir, cleanup_errors))
+        cleanup.start()
 
     saved_files = download_and_extract(owner, repo, output_dir)
 
+    if cleanup is not None:
+        cleanup.join()
+        for e in cleanup_errors:
+            console.print(f"[yellow]Warning:[/yellow] Could not fully remove previous output at {stale_dir}: {e}")
+
     if not saved_files:
         # Error or no files found, messages are printed inside the function
         shutil.rmtree(output_dir, ignore_errors=True)